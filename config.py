@@ -34,6 +34,12 @@ HISTORY_PERIOD = "2y"
 # SQLite database file — stored in the data/ folder
 DB_PATH = os.path.join(os.path.dirname(__file__), "data", "market_reporting.db")
 
+# ── Download Cache ────────────────────────────────────────────────────────────
+# Raw Yahoo Finance downloads are saved here (one parquet file per ticker).
+# Re-running ingestion within DOWNLOAD_CACHE_SECONDS reuses them.
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "data", "cache")
+DOWNLOAD_CACHE_SECONDS = 3600  # 1 hour
+
 # ── Metric Parameters ─────────────────────────────────────────────────────────
 ROLLING_VOL_WINDOW   = 20   # days for rolling volatility calculation
 ROLLING_BETA_WINDOW  = 60   # days for rolling beta calculation
@@ -11,7 +11,9 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from sqlalchemy import create_engine
+from tsdownsample import MinMaxLTTBDownsampler
+from sqlalchemy import create_engine, text, bindparam
+from datetime import date, timedelta
 
 import config
 
@@ -24,31 +26,121 @@ st.set_page_config(
 
 engine = create_engine(f"sqlite:///{config.DB_PATH}")
 
+# Dates are stored in the database as whole days since this date
+EPOCH = date(1970, 1, 1)
+
 
 @st.cache_data(ttl=300)  # cache for 5 minutes so the dashboard stays fast
-def load_returns():
+def load_filter_options():
+    """Ticker list and date bounds for the sidebar filters."""
+    with engine.connect() as conn:
+        tickers = conn.execute(
+            text("SELECT DISTINCT ticker FROM returns_daily ORDER BY ticker")
+        ).scalars().all()
+        min_date, max_date = conn.execute(
+            text("SELECT MIN(date), MAX(date) FROM returns_daily")
+        ).one()
+    return tickers, min_date, max_date
+
+
+# Numeric columns per table. A small query can return nothing but NULLs in a
+# column (e.g. beta in the first weeks), and without a declared type pyarrow
+# would read it as a string column full of pd.NA.
+NUMERIC_COLUMNS = {
+    "returns_daily": {
+        "return_1d":         "float64[pyarrow]",
+        "return_5d":         "float64[pyarrow]",
+        "return_1m":         "float64[pyarrow]",
+        "cumulative_return": "float64[pyarrow]",
+        "rolling_vol_20d":   "float64[pyarrow]",
+        "rolling_beta_60d":  "float64[pyarrow]",
+        "drawdown":          "float64[pyarrow]",
+    },
+    "prices_daily": {
+        "open":      "float64[pyarrow]",
+        "high":      "float64[pyarrow]",
+        "low":       "float64[pyarrow]",
+        "close":     "float64[pyarrow]",
+        "adj_close": "float64[pyarrow]",
+        "volume":    "int64[pyarrow]",
+    },
+}
+
+
+# Filtering happens in SQL, so only the selected tickers and dates are read.
+# Streamlit caches one result per (tickers, start, end) combination.
+# dtype_backend="pyarrow" reads each column straight into an Arrow buffer
+# instead of building a Python object per cell.
+def load_filtered(table: str, tickers: tuple, start: date, end: date) -> pd.DataFrame:
+    query = text(f"""
+        SELECT * FROM {table}
+        WHERE ticker IN :tickers AND date BETWEEN :start AND :end
+        ORDER BY date, ticker
+    """).bindparams(bindparam("tickers", expanding=True))
     with engine.connect() as conn:
-        return pd.read_sql(
-            "SELECT * FROM returns_daily ORDER BY date, ticker",
+        df = pd.read_sql(
+            query,
             conn,
-            parse_dates=["date"]
+            params={
+                "tickers": list(tickers),
+                "start":   (start - EPOCH).days,
+                "end":     (end - EPOCH).days,
+            },
+            dtype_backend="pyarrow",
+            dtype=NUMERIC_COLUMNS[table],
         )
+    df["date"] = pd.to_datetime(df["date"], unit="D")
+    # Store tickers as small integer codes, so groupby/isin don't hash strings
+    df["ticker"] = df["ticker"].astype("category")
+    return df
 
 
 @st.cache_data(ttl=300)
-def load_prices():
-    with engine.connect() as conn:
-        return pd.read_sql(
-            "SELECT * FROM prices_daily ORDER BY date, ticker",
-            conn,
-            parse_dates=["date"]
-        )
+def load_returns(tickers: tuple, start: date, end: date) -> pd.DataFrame:
+    return load_filtered("returns_daily", tickers, start, end)
+
+
+@st.cache_data(ttl=300)
+def load_prices(tickers: tuple, start: date, end: date) -> pd.DataFrame:
+    return load_filtered("prices_daily", tickers, start, end)
+
+
+# Plotly slows down badly past a few thousand points per line, and a chart
+# this size can't show more detail than ~1500 points anyway.
+MAX_POINTS_PER_LINE = 1500
+
+
+def downsample(df: pd.DataFrame, y: str, n_out: int = MAX_POINTS_PER_LINE) -> pd.DataFrame:
+    """
+    Thin each ticker's series to at most `n_out` rows before plotting.
+    MinMaxLTTB keeps the peaks and troughs, so the chart looks the same.
+    """
+    downsampler = MinMaxLTTBDownsampler()
+    df = df.dropna(subset=[y])
+    pieces = []
+    for _, group in df.groupby("ticker", sort=False, observed=True):
+        if len(group) > n_out:
+            idx = downsampler.downsample(
+                group["date"].to_numpy().view("int64"),
+                group[y].to_numpy(dtype="float64"),
+                n_out=n_out,
+            )
+            group = group.iloc[idx]
+        pieces.append(group)
+    return pd.concat(pieces) if pieces else df
 
 
 # ── Load data ─────────────────────────────────────────────────────────────────
 try:
-    returns_df = load_returns()
-    prices_df  = load_prices()
+    available_tickers, min_date, max_date = load_filter_options()
+    if available_tickers:
+        if not isinstance(min_date, int):
+            raise ValueError(
+                "the database uses the old TEXT date format — delete "
+                "data/market_reporting.db and rebuild it"
+            )
+        min_date = EPOCH + timedelta(days=min_date)
+        max_date = EPOCH + timedelta(days=max_date)
     data_loaded = True
 except Exception as e:
     data_loaded = False
@@ -57,16 +149,13 @@ except Exception as e:
 # ── Sidebar ───────────────────────────────────────────────────────────────────
 st.sidebar.title("⚙️ Filters")
 
-if data_loaded and not returns_df.empty:
-    available_tickers = sorted(returns_df["ticker"].unique().tolist())
+if data_loaded and available_tickers:
     selected_tickers  = st.sidebar.multiselect(
         "Select Tickers",
         options=available_tickers,
         default=available_tickers[:5],  # default: first 5
     )
 
-    min_date = returns_df["date"].min().date()
-    max_date = returns_df["date"].max().date()
     date_range = st.sidebar.date_input(
         "Date Range",
         value=(min_date, max_date),
@@ -79,14 +168,6 @@ if data_loaded and not returns_df.empty:
     else:
         start_date, end_date = min_date, max_date
 
-    # Apply filters
-    mask = (
-        returns_df["ticker"].isin(selected_tickers) &
-        (returns_df["date"].dt.date >= start_date) &
-        (returns_df["date"].dt.date <= end_date)
-    )
-    filtered = returns_df[mask].copy()
-
 st.sidebar.markdown("---")
 st.sidebar.markdown("**How to refresh data:**")
 st.sidebar.code("python src/ingest_prices.py\npython src/build_metrics.py")
@@ -99,38 +180,47 @@ if not data_loaded:
     st.info("Run these commands first:\n```\npython src/ingest_prices.py\npython src/build_metrics.py\n```")
     st.stop()
 
-if returns_df.empty:
+if not available_tickers:
     st.warning("No data found. Run the ingestion and metrics scripts first.")
     st.stop()
 
 # ── Tab layout ────────────────────────────────────────────────────────────────
-tab1, tab2, tab3 = st.tabs(["📊 Executive Summary", "⚠️ Risk Monitor", "📉 Price History"])
+# st.tabs would run all three tabs on every rerun, even the hidden ones.
+# With a selector, only the visible tab queries the database and builds figures.
+tab = st.radio(
+    "View",
+    ["📊 Executive Summary", "⚠️ Risk Monitor", "📉 Price History"],
+    horizontal=True,
+    label_visibility="collapsed",
+)
 
 # =============================================================================
 # TAB 1 — Executive Summary
 # =============================================================================
-with tab1:
+if tab == "📊 Executive Summary":
     st.subheader("Performance Snapshot")
 
+    filtered = load_returns(tuple(selected_tickers), start_date, end_date)
+
     if filtered.empty:
         st.warning("No data for selected filters.")
     else:
-        # Latest metrics per ticker
+        # Latest metrics per ticker — the data is already sorted by date,
+        # so each ticker's last row is its most recent one
         latest = (
-            filtered.sort_values("date")
-            .groupby("ticker")
-            .last()
-            .reset_index()
+            filtered.drop_duplicates(subset="ticker", keep="last")
+            .reset_index(drop=True)
         )
 
         # KPI cards — show for up to 5 tickers
         cols = st.columns(min(len(latest), 5))
-        for i, row in latest.head(5).iterrows():
+        # itertuples gives light namedtuples instead of building a Series per row
+        for i, row in enumerate(latest.head(5).itertuples(index=False)):
             with cols[i % 5]:
-                ret_1d = row.get("return_1d", 0) or 0
+                ret_1d = row.return_1d if pd.notna(row.return_1d) else 0
                 color  = "🟢" if ret_1d >= 0 else "🔴"
                 st.metric(
-                    label=row["ticker"],
+                    label=row.ticker,
                     value=f"{ret_1d * 100:.2f}%",
                     delta=f"1D return",
                 )
@@ -140,12 +230,13 @@ with tab1:
         # Cumulative return chart
         st.subheader("Cumulative Return vs. SPY")
         fig = px.line(
-            filtered,
+            downsample(filtered, "cumulative_return"),
             x="date",
             y="cumulative_return",
             color="ticker",
             labels={"cumulative_return": "Cumulative Return", "date": "Date"},
             title="Cumulative Return from Start of Period",
+            render_mode="webgl",  # draw on the GPU instead of as SVG
         )
         fig.update_yaxes(tickformat=".0%")
         fig.update_layout(hovermode="x unified", legend_title="Ticker")
@@ -154,18 +245,22 @@ with tab1:
         # Summary table
         st.subheader("Return Summary Table")
         summary = latest[["ticker", "return_1d", "return_5d", "return_1m", "cumulative_return"]].copy()
-        for col in ["return_1d", "return_5d", "return_1m", "cumulative_return"]:
-            summary[col] = summary[col].apply(lambda x: f"{x*100:.2f}%" if pd.notna(x) else "N/A")
         summary.columns = ["Ticker", "1D Return", "5D Return", "1M Return", "Cumulative"]
-        st.dataframe(summary.set_index("Ticker"), use_container_width=True)
+        # Styler formats at render time, so the columns stay numeric (and sortable)
+        st.dataframe(
+            summary.set_index("Ticker").style.format("{:.2%}", na_rep="N/A"),
+            use_container_width=True,
+        )
 
 
 # =============================================================================
 # TAB 2 — Risk Monitor
 # =============================================================================
-with tab2:
+elif tab == "⚠️ Risk Monitor":
     st.subheader("Risk Metrics")
 
+    filtered = load_returns(tuple(selected_tickers), start_date, end_date)
+
     if filtered.empty:
         st.warning("No data for selected filters.")
     else:
@@ -175,11 +270,12 @@ with tab2:
             # Rolling volatility
             st.markdown("**Rolling 20-Day Volatility (Annualized)**")
             fig_vol = px.line(
-                filtered,
+                downsample(filtered, "rolling_vol_20d"),
                 x="date",
                 y="rolling_vol_20d",
                 color="ticker",
                 labels={"rolling_vol_20d": "Volatility", "date": "Date"},
+                render_mode="webgl",
             )
             fig_vol.update_yaxes(tickformat=".0%")
             fig_vol.update_layout(hovermode="x unified", showlegend=True)
@@ -188,67 +284,74 @@ with tab2:
         with col2:
             # Drawdown
             st.markdown("**Drawdown from Rolling Peak**")
-            fig_dd = px.area(
-                filtered,
-                x="date",
-                y="drawdown",
-                color="ticker",
-                labels={"drawdown": "Drawdown", "date": "Date"},
-            )
-            fig_dd.update_yaxes(tickformat=".0%")
+            # px.area has no WebGL mode, so build filled Scattergl traces by hand
+            dd_data = downsample(filtered, "drawdown")
+            fig_dd = go.Figure([
+                go.Scattergl(x=group["date"], y=group["drawdown"], name=ticker,
+                             mode="lines", fill="tozeroy")
+                for ticker, group in dd_data.groupby("ticker", sort=False, observed=True)
+            ])
+            fig_dd.update_xaxes(title="Date")
+            fig_dd.update_yaxes(title="Drawdown", tickformat=".0%")
             fig_dd.update_layout(hovermode="x unified", showlegend=True)
             st.plotly_chart(fig_dd, use_container_width=True)
 
         # Beta table
         st.subheader(f"Rolling 60-Day Beta vs. {config.BENCHMARK}")
         latest_beta = (
-            filtered.sort_values("date")
-            .groupby("ticker")[["ticker", "date", "rolling_beta_60d"]]
-            .last()
-            .reset_index(drop=True)
-        )
-        latest_beta["rolling_beta_60d"] = latest_beta["rolling_beta_60d"].apply(
-            lambda x: f"{x:.2f}" if pd.notna(x) else "N/A"
+            filtered.drop_duplicates(subset="ticker", keep="last")
+            [["ticker", "date", "rolling_beta_60d"]]
         )
         latest_beta.columns = ["Ticker", "As Of Date", "Beta vs SPY"]
-        st.dataframe(latest_beta.set_index("Ticker"), use_container_width=True)
+        st.dataframe(
+            latest_beta.set_index("Ticker").style.format({"Beta vs SPY": "{:.2f}"}, na_rep="N/A"),
+            use_container_width=True,
+        )
         st.caption("Beta > 1 means the stock tends to move more than the market. Beta < 1 means less.")
 
 
 # =============================================================================
 # TAB 3 — Price History
 # =============================================================================
-with tab3:
+elif tab == "📉 Price History":
     st.subheader("Adjusted Close Price History")
 
-    price_filtered = prices_df[
-        prices_df["ticker"].isin(selected_tickers) &
-        (prices_df["date"].dt.date >= start_date) &
-        (prices_df["date"].dt.date <= end_date)
-    ]
+    price_filtered = load_prices(tuple(selected_tickers), start_date, end_date)
 
     if price_filtered.empty:
         st.warning("No price data for selected filters.")
     else:
         fig_price = px.line(
-            price_filtered,
+            downsample(price_filtered, "adj_close"),
             x="date",
             y="adj_close",
             color="ticker",
             labels={"adj_close": "Adjusted Close ($)", "date": "Date"},
             title="Adjusted Close Prices",
+            render_mode="webgl",
         )
         fig_price.update_layout(hovermode="x unified")
         st.plotly_chart(fig_price, use_container_width=True)
 
-        # Volume chart
-        st.subheader("Daily Volume")
+        # Volume chart — over long ranges one bar per ticker per day means
+        # thousands of SVG bars, so sum the volume by week instead
+        if (end_date - start_date).days > 180:
+            st.subheader("Weekly Volume")
+            volume = (
+                price_filtered.set_index("date")
+                .groupby("ticker", observed=True)["volume"]
+                .resample("W")
+                .sum()
+                .reset_index()
+            )
+        else:
+            st.subheader("Daily Volume")
+            volume = price_filtered
         fig_vol2 = px.bar(
-            price_filtered,
+            volume,
             x="date",
             y="volume",
-            color="ticker",
-            barmode="group",
+            color="ticker",  # stacked, one bar per date
             labels={"volume": "Volume", "date": "Date"},
         )
         st.plotly_chart(fig_vol2, use_container_width=True)
@@ -15,7 +15,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, event
 from datetime import datetime
 
 import config
@@ -24,12 +24,22 @@ import config
 engine = create_engine(f"sqlite:///{config.DB_PATH}")
 
 
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_conn, _):
+    """Per-connection SQLite settings: fewer fsyncs and a bigger page cache."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, much faster commits
+    cursor.execute("PRAGMA cache_size=-65536")   # 64 MB page cache
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 def create_returns_table():
     """Create the returns_daily table if it doesn't exist yet."""
     with engine.connect() as conn:
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS returns_daily (
-                date              TEXT NOT NULL,
+                date              INTEGER NOT NULL,  -- days since 1970-01-01
                 ticker            TEXT NOT NULL,
                 return_1d         REAL,   -- single-day % return
                 return_5d         REAL,   -- 5-day (weekly) % return
@@ -42,31 +52,107 @@ def create_returns_table():
                 PRIMARY KEY (date, ticker)
             )
         """))
+        # Databases created before dates were stored as integers still have a
+        # TEXT date column — writing integer dates into it would duplicate every row
+        columns = conn.execute(text("PRAGMA table_info(returns_daily)")).mappings().all()
+        date_type = next(col["type"] for col in columns if col["name"] == "date")
+        if date_type.upper() != "INTEGER":
+            sys.exit(
+                f"'returns_daily' in {config.DB_PATH} uses the old TEXT date format.\n"
+                "Delete the database file and re-run src/ingest_prices.py and "
+                "src/build_metrics.py to rebuild it."
+            )
+        # The dashboard filters by ticker first, then by date range
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_returns_ticker_date
+            ON returns_daily (ticker, date)
+        """))
+        # WAL is remembered by the database file, so setting it once is enough.
+        # It lets the dashboard keep reading while this script is writing.
+        conn.execute(text("PRAGMA journal_mode=WAL"))
         conn.commit()
     print("Table 'returns_daily' is ready.")
 
 
 def load_prices() -> pd.DataFrame:
-    """Load prices from SQLite into a pandas DataFrame."""
+    """
+    Load prices from SQLite into a pandas DataFrame.
+    Dates stay as integer days since 1970-01-01 — that's all the metrics need.
+    """
     query = "SELECT date, ticker, adj_close FROM prices_daily ORDER BY ticker, date"
     with engine.connect() as conn:
-        df = pd.read_sql(query, conn, parse_dates=["date"])
+        df = pd.read_sql(query, conn)
     print(f"Loaded {len(df)} rows from prices_daily.")
     return df
 
 
-def compute_metrics(prices_df: pd.DataFrame) -> pd.DataFrame:
+def load_wide_prices() -> pd.DataFrame:
     """
-    Given a long-format DataFrame of (date, ticker, adj_close),
-    compute all our KPI columns and return a long-format results DataFrame.
+    Load adjusted closes as a matrix where rows = dates, columns = tickers.
+
+    The matrix is cached in data/cache/ as parquet, tagged with the latest
+    load_timestamp in prices_daily. If ingestion hasn't run since the last
+    build, the cached copy is reused instead of re-reading and re-pivoting.
     """
+    cache_path = os.path.join(config.CACHE_DIR, "wide_prices.parquet")
+    stamp_path = os.path.join(config.CACHE_DIR, "wide_prices.stamp")
+
+    with engine.connect() as conn:
+        stamp = conn.execute(text("SELECT MAX(load_timestamp) FROM prices_daily")).scalar()
+
+    if stamp is not None and os.path.exists(cache_path) and os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if f.read() == stamp:
+                wide = pd.read_parquet(cache_path)
+                print(f"Reusing cached prices ({wide.shape[0]} dates × {wide.shape[1]} tickers).")
+                return wide
 
     # ── Pivot to wide format ──────────────────────────────────────────────────
-    # We need a matrix where rows = dates, columns = tickers
     # This makes rolling calculations much easier
-    wide = prices_df.pivot(index="date", columns="ticker", values="adj_close")
+    prices = load_prices()
+    wide = prices.pivot(index="date", columns="ticker", values="adj_close")
     wide = wide.sort_index()  # make sure dates are in order
 
+    if stamp is not None:
+        os.makedirs(config.CACHE_DIR, exist_ok=True)
+        wide.to_parquet(cache_path)
+        with open(stamp_path, "w") as f:  # written last, so a half-written cache is never used
+            f.write(stamp)
+    return wide
+
+
+def rolling_mean(values: np.ndarray, window: int, min_periods: int):
+    """
+    Rolling mean down each column of a 2-D array, ignoring NaNs.
+
+    Uses cumulative sums, so every column is handled in one vectorized pass
+    instead of one pandas rolling object per ticker.
+    Returns (means, counts) — means are NaN where fewer than `min_periods`
+    values were available in the window.
+    """
+    valid  = ~np.isnan(values)
+    zeroed = np.where(valid, values, 0.0)
+
+    # Pad with a row of zeros so that window sums are a simple difference
+    sums   = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(zeroed, axis=0)])
+    counts = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(valid, axis=0)])
+
+    end   = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    window_sums   = sums[end] - sums[start]
+    window_counts = counts[end] - counts[start]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = np.where(window_counts >= min_periods, window_sums / window_counts, np.nan)
+    return means, window_counts
+
+
+def compute_metrics(wide: pd.DataFrame) -> pd.DataFrame:
+    """
+    Given a wide DataFrame of adjusted closes (rows = dates, columns = tickers),
+    compute all our KPI columns and return a long-format results DataFrame.
+    """
+
     # ── Daily returns ─────────────────────────────────────────────────────────
     # pct_change() computes (today - yesterday) / yesterday
     returns_1d = wide.pct_change()
@@ -75,64 +161,87 @@ def compute_metrics(prices_df: pd.DataFrame) -> pd.DataFrame:
     returns_5d = wide.pct_change(periods=5)   # ~1 week
     returns_1m = wide.pct_change(periods=21)  # ~1 month
 
+    # The metrics below work on the raw numpy matrices (rows = dates,
+    # columns = tickers) and are wrapped back into DataFrames at the end
+    P = wide.to_numpy()
+    R = returns_1d.to_numpy()
+
+    def to_frame(values):
+        return pd.DataFrame(values, index=wide.index, columns=wide.columns)
+
     # ── Cumulative return from start ─────────────────────────────────────────
     # (current price / first price) - 1
-    cumulative = wide.div(wide.iloc[0]) - 1
+    cumulative = to_frame(P / P[0] - 1)
 
     # ── Rolling volatility (annualized) ──────────────────────────────────────
     # Volatility = std of daily returns × sqrt(252)
     # 252 = approximate trading days in a year
-    rolling_vol = (
-        returns_1d
-        .rolling(window=config.ROLLING_VOL_WINDOW, min_periods=10)
-        .std()
-        * np.sqrt(252)
-    )
+    # var(X) = E[XX] - E[X]², from the same rolling means used for beta below
+    vol_mean,    vol_n = rolling_mean(R,     config.ROLLING_VOL_WINDOW, 10)
+    vol_mean_sq, _     = rolling_mean(R * R, config.ROLLING_VOL_WINDOW, 10)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        daily_var = (vol_mean_sq - vol_mean ** 2) * (vol_n / (vol_n - 1))
+    # Rounding can leave a tiny negative variance on a flat window — treat it as 0
+    rolling_vol = to_frame(np.sqrt(np.maximum(daily_var, 0)) * np.sqrt(252))
 
     # ── Rolling beta vs SPY ───────────────────────────────────────────────────
     # Beta measures how much a stock moves relative to the market.
     # Beta = cov(stock, SPY) / var(SPY)
-    # We calculate it in a rolling window of 60 days.
-    spy_returns = returns_1d[config.BENCHMARK] if config.BENCHMARK in returns_1d.columns else None
-
+    # We calculate it in a rolling window of 60 days, for every ticker at once:
+    #   cov(X, S) = E[XS] - E[X]·E[S]      var(S) = E[SS] - E[S]²
+    # so we only need rolling means of the whole returns matrix.
     rolling_beta = pd.DataFrame(index=wide.index, columns=wide.columns, dtype=float)
-    if spy_returns is not None:
-        for ticker in wide.columns:
-            stock_returns = returns_1d[ticker]
-            # zip the two series together and roll through 60-day windows
-            combined = pd.concat([stock_returns, spy_returns], axis=1)
-            combined.columns = ["stock", "spy"]
-            # Compute rolling beta using rolling cov / rolling var
-            roll_cov = stock_returns.rolling(config.ROLLING_BETA_WINDOW, min_periods=30).cov(spy_returns)
-            roll_var = spy_returns.rolling(config.ROLLING_BETA_WINDOW, min_periods=30).var()
-            rolling_beta[ticker] = roll_cov / roll_var
+    if config.BENCHMARK in returns_1d.columns:
+        s = returns_1d[config.BENCHMARK].to_numpy()[:, None]   # SPY as a column vector
+        window, min_periods = config.ROLLING_BETA_WINDOW, 30
+
+        # For the covariance, only use days where both the stock and SPY have a
+        # return (like pandas does). This matters for tickers whose history
+        # starts later than SPY's, e.g. a recent IPO.
+        both = ~np.isnan(R) & ~np.isnan(s)
+        x_paired = np.where(both, R, np.nan)
+        s_paired = np.where(both, s, np.nan)
+
+        mean_x,  _    = rolling_mean(x_paired,            window, min_periods)
+        mean_sp, _    = rolling_mean(s_paired,            window, min_periods)
+        mean_xs, n_xs = rolling_mean(x_paired * s_paired, window, min_periods)
+        mean_s,  n_s  = rolling_mean(s,                   window, min_periods)
+        mean_ss, _    = rolling_mean(s * s,               window, min_periods)
+
+        # n / (n - 1) turns the population moments into sample moments,
+        # matching pandas' rolling cov() and var() (ddof=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            roll_cov = (mean_xs - mean_x * mean_sp) * (n_xs / (n_xs - 1))
+            roll_var = (mean_ss - mean_s ** 2) * (n_s / (n_s - 1))
+            rolling_beta[:] = roll_cov / roll_var
 
     # ── Drawdown ─────────────────────────────────────────────────────────────
     # Drawdown = how far below the rolling peak we currently are
     # Always ≤ 0. -0.20 means we're 20% below the most recent high.
-    rolling_max = wide.cummax()  # the highest price seen up to each date
-    drawdown = (wide - rolling_max) / rolling_max
+    # fmax (unlike maximum) skips over missing prices instead of spreading NaN
+    rolling_max = np.fmax.accumulate(P, axis=0)  # the highest price seen up to each date
+    drawdown = to_frame(P / rolling_max - 1)
 
     # ── Combine all metrics back to long format ───────────────────────────────
-    # Each metric is a wide DataFrame. We'll melt each one then merge them.
-    def melt_metric(df_wide, col_name):
-        return (
-            df_wide
-            .reset_index()
-            .melt(id_vars="date", var_name="ticker", value_name=col_name)
-        )
+    # Each metric is a wide DataFrame with the same dates and tickers, so
+    # stacking them gives identically-indexed (date, ticker) Series that can
+    # simply be placed side by side — no joins needed.
+    def stack_metric(df_wide, col_name):
+        return df_wide.stack(future_stack=True).rename(col_name)
+
+    metrics = pd.concat(
+        [
+            stack_metric(returns_1d,   "return_1d"),
+            stack_metric(returns_5d,   "return_5d"),
+            stack_metric(returns_1m,   "return_1m"),
+            stack_metric(cumulative,   "cumulative_return"),
+            stack_metric(rolling_vol,  "rolling_vol_20d"),
+            stack_metric(rolling_beta, "rolling_beta_60d"),
+            stack_metric(drawdown,     "drawdown"),
+        ],
+        axis=1,
+    ).reset_index()
 
-    metrics = (
-        melt_metric(returns_1d,   "return_1d")
-        .merge(melt_metric(returns_5d,   "return_5d"),   on=["date", "ticker"])
-        .merge(melt_metric(returns_1m,   "return_1m"),   on=["date", "ticker"])
-        .merge(melt_metric(cumulative,   "cumulative_return"), on=["date", "ticker"])
-        .merge(melt_metric(rolling_vol,  "rolling_vol_20d"),   on=["date", "ticker"])
-        .merge(melt_metric(rolling_beta, "rolling_beta_60d"),  on=["date", "ticker"])
-        .merge(melt_metric(drawdown,     "drawdown"),          on=["date", "ticker"])
-    )
-
-    metrics["date"] = pd.to_datetime(metrics["date"]).dt.strftime("%Y-%m-%d")
     metrics["load_timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     return metrics
@@ -140,14 +249,21 @@ def compute_metrics(prices_df: pd.DataFrame) -> pd.DataFrame:
 
 def save_metrics(metrics_df: pd.DataFrame):
     """Write the computed metrics to the returns_daily table."""
-    with engine.connect() as conn:
-        metrics_df.to_sql("returns_daily_staging", conn, if_exists="replace", index=False)
-        conn.execute(text("""
-            INSERT OR REPLACE INTO returns_daily
-            SELECT * FROM returns_daily_staging
-        """))
-        conn.execute(text("DROP TABLE IF EXISTS returns_daily_staging"))
-        conn.commit()
+    # Insert straight into the table with executemany, in a single transaction.
+    # INSERT OR REPLACE overwrites rows for (date, ticker) combos we already have.
+    columns = ", ".join(metrics_df.columns)
+    placeholders = ", ".join("?" * len(metrics_df.columns))
+    rows = list(metrics_df.itertuples(index=False, name=None))
+
+    raw = engine.raw_connection()
+    try:
+        raw.cursor().executemany(
+            f"INSERT OR REPLACE INTO returns_daily ({columns}) VALUES ({placeholders})",
+            rows,
+        )
+        raw.commit()
+    finally:
+        raw.close()
     print(f" Saved {len(metrics_df)} rows to 'returns_daily'.")
 
 
@@ -159,7 +275,7 @@ if __name__ == "__main__":
 
     create_returns_table()
 
-    prices = load_prices()
+    prices = load_wide_prices()
 
     if prices.empty:
         print(" No prices found. Run ingest_prices.py first!")
@@ -11,12 +11,14 @@
 
 import sys
 import os
+import time
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # lets us import config.py
 
 import yfinance as yf
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, event
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import config  # our central settings file
 
@@ -27,6 +29,16 @@ import config  # our central settings file
 engine = create_engine(f"sqlite:///{config.DB_PATH}")
 
 
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_conn, _):
+    """Per-connection SQLite settings: fewer fsyncs and a bigger page cache."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, much faster commits
+    cursor.execute("PRAGMA cache_size=-65536")   # 64 MB page cache
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 def create_tables():
     """
     Create the database tables if they don't already exist.
@@ -35,7 +47,7 @@ def create_tables():
     with engine.connect() as conn:
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS prices_daily (
-                date           TEXT NOT NULL,
+                date           INTEGER NOT NULL,   -- days since 1970-01-01
                 ticker         TEXT NOT NULL,
                 open           REAL,
                 high           REAL,
@@ -48,10 +60,53 @@ def create_tables():
                 PRIMARY KEY (date, ticker)   -- ensures no duplicate rows
             )
         """))
+        # Databases created before dates were stored as integers still have a
+        # TEXT date column — writing integer dates into it would duplicate every row
+        columns = conn.execute(text("PRAGMA table_info(prices_daily)")).mappings().all()
+        date_type = next(col["type"] for col in columns if col["name"] == "date")
+        if date_type.upper() != "INTEGER":
+            sys.exit(
+                f"'prices_daily' in {config.DB_PATH} uses the old TEXT date format.\n"
+                "Delete the database file and re-run src/ingest_prices.py and "
+                "src/build_metrics.py to rebuild it."
+            )
+        # The dashboard filters by ticker first, then by date range
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_prices_ticker_date
+            ON prices_daily (ticker, date)
+        """))
+        # WAL is remembered by the database file, so setting it once is enough.
+        # It lets the dashboard keep reading while this script is writing.
+        conn.execute(text("PRAGMA journal_mode=WAL"))
         conn.commit()
     print(" Table 'prices_daily' is ready.")
 
 
+def download_ticker(ticker: str, period: str) -> pd.DataFrame:
+    """
+    Download one ticker's daily prices, or reuse a recent copy from the cache.
+
+    Each download is saved as data/cache/<ticker>_<period>.parquet, so a re-run
+    within the hour (e.g. after one ticker failed) only fetches what's missing.
+    """
+    cache_path = os.path.join(config.CACHE_DIR, f"{ticker}_{period}.parquet")
+    if (os.path.exists(cache_path)
+            and time.time() - os.path.getmtime(cache_path) < config.DOWNLOAD_CACHE_SECONDS):
+        return pd.read_parquet(cache_path)
+
+    # Ticker.history() rather than yf.download(): download() keeps its results
+    # in shared module state, so it isn't safe to call from several threads
+    df = yf.Ticker(ticker).history(
+        period=period,
+        auto_adjust=False,   # keep both 'Close' and 'Adj Close'
+        actions=False,       # we don't need dividends / splits columns
+    )
+    if not df.empty:
+        df.index = df.index.tz_localize(None)  # keep the exchange's local dates
+        df.to_parquet(cache_path)
+    return df
+
+
 def fetch_and_save_prices(tickers: list, period: str):
     """
     Download price data for a list of tickers and save to the database.
@@ -62,30 +117,20 @@ def fetch_and_save_prices(tickers: list, period: str):
     """
     print(f"\n Downloading data for {len(tickers)} tickers ({period} of history)...")
 
-    # yfinance can download multiple tickers at once — very convenient
-    raw = yf.download(
-        tickers=tickers,
-        period=period,
-        auto_adjust=False,   # keep both 'Close' and 'Adj Close'
-        progress=True,
-        group_by="ticker",   # organize results by ticker
-    )
-
-    if raw.empty:
-        print("No data returned from yfinance. Check your internet connection.")
-        return
+    # Network latency dominates, so fetch the tickers in parallel
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        downloads = {ticker: pool.submit(download_ticker, ticker, period) for ticker in tickers}
 
     load_ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # timestamp for auditing
     all_rows = []  # we'll collect all rows here, then insert in one go
 
     for ticker in tickers:
         try:
-            # When downloading multiple tickers, yfinance nests the data
-            # We pull out each ticker's slice like this:
-            if len(tickers) == 1:
-                df = raw.copy()
-            else:
-                df = raw[ticker].copy()
+            df = downloads[ticker].result()  # re-raises any download error
+            if df.empty:
+                print(f"    Skipping {ticker} — no data returned")
+                continue
 
             df = df.dropna(how="all")  # drop completely empty rows
 
@@ -107,7 +152,9 @@ def fetch_and_save_prices(tickers: list, period: str):
             # Convert the index (dates) into a plain column
             df = df.reset_index()
             df = df.rename(columns={"Date": "date", "Datetime": "date"})
-            df["date"] = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d")
+            # Dates are stored as whole days since 1970-01-01, so range filters
+            # compare integers and nothing has to parse them on the way back out
+            df["date"] = df["date"].to_numpy().astype("datetime64[D]").astype("int64")
 
             # Keep only the columns our table expects
             df = df[["date", "ticker", "open", "high", "low", "close",
@@ -128,15 +175,22 @@ def fetch_and_save_prices(tickers: list, period: str):
 
     # "replace" means: if rows for these (date, ticker) combos already exist,
     # overwrite them. This makes the script safe to re-run.
-    with engine.connect() as conn:
-        # We use INSERT OR REPLACE to handle the primary key constraint
-        combined.to_sql("prices_daily_staging", conn, if_exists="replace", index=False)
-        conn.execute(text("""
-            INSERT OR REPLACE INTO prices_daily
-            SELECT * FROM prices_daily_staging
-        """))
-        conn.execute(text("DROP TABLE IF EXISTS prices_daily_staging"))
-        conn.commit()
+    # We use INSERT OR REPLACE to handle the primary key constraint.
+    # executemany on the raw sqlite3 connection writes every row in a single
+    # transaction, with no staging table in between.
+    columns = ", ".join(combined.columns)
+    placeholders = ", ".join("?" * len(combined.columns))
+    rows = list(combined.itertuples(index=False, name=None))
+
+    raw = engine.raw_connection()
+    try:
+        raw.cursor().executemany(
+            f"INSERT OR REPLACE INTO prices_daily ({columns}) VALUES ({placeholders})",
+            rows,
+        )
+        raw.commit()
+    finally:
+        raw.close()
 
     print(f"\n✅ Saved {len(combined)} total rows to 'prices_daily'.")
 